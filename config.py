@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -7,7 +8,40 @@ class Settings(BaseSettings):
     log_path: str = "logs/app.log"
     crawler_depth: int = 2
     crawler_max_pages: int = 10
+    crawler_concurrency: int = 5
+    crawler_batch_size: int = 50  # Pages handed to indexing (and checkpointed) at a time
+    crawl_state_path: str = "crawl_state/frontier.sqlite3"
+    crawler_max_attempts: int = 3  # Fetches of a failing URL across resumes before it is given up
+    crawler_max_consecutive_failures: int = 20  # Stop the crawl as interrupted after this many failures in a row
+    # Near-duplicate filtering at ingest (MinHash LSH)
+    dedup_enabled: bool = True
+    dedup_threshold: float = 0.85
+    dedup_index_path: str = "crawl_state/dedup.sqlite3"
+    # On-demand profiling; disabled unless admin_token is set
+    admin_token: Optional[str] = None
+    profile_output_dir: str = "profiles"
+    profile_sample_interval: float = 0.005
+    profile_max_seconds: float = 300.0  # Upper bound on any profiling session
+    loop_stall_threshold_ms: float = 0  # 0 disables the event loop stall detector
+    # Speculative retrieval for type-ahead clients (/chat/prefetch)
+    prefetch_ttl: float = 30.0
+    prefetch_match_threshold: float = 0.8  # Word-set Jaccard similarity to reuse a prefetch
+    prefetch_min_chars: int = 8
+    prefetch_max_concurrency: int = 2
+    prefetch_max_sessions: int = 1000
+    prefetch_join_timeout: float = 2.0  # How long /chat/stream waits for an in-flight prefetch
     document_store_path: str = "./document_store"  # Added new field
+    # Gemini admission control (requests per minute should match the project quota)
+    gemini_llm_rpm: int = 15
+    gemini_llm_burst: int = 5
+    gemini_embedding_rpm: int = 1500
+    gemini_embedding_burst: int = 50
+    gemini_max_concurrency: int = 8
+    gemini_max_retries: int = 3
+    gemini_backoff_base: float = 1.0
+    gemini_backoff_max: float = 30.0
+    admission_queue_size: int = 100
+    admission_max_wait: float = 30.0
     PORT: int
     class Config:
         env_file = ".env"
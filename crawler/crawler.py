@@ -1,8 +1,16 @@
+import asyncio
 import logging
+from contextlib import aclosing
+from typing import AsyncGenerator, List, Optional, Tuple
 from crawl4ai import AsyncWebCrawler
 from langchain.schema import Document
 from config import settings
 from utils.chroma_utils import index_documents_to_chroma
+from crawler.discovery import (
+    USER_AGENT, normalize_url, same_site, load_robots, discover_sitemap_urls, make_session,
+)
+from crawler.frontier import CrawlFrontier, DONE, FAILED, PENDING, FETCHED
+from utils.rate_limiter import AdmissionRejected
 from bs4 import BeautifulSoup
 import re
 
@@ -10,95 +18,165 @@ import re
 logging.basicConfig(filename=settings.log_path, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def crawl_website(url: str, max_pages: int, depth: int) -> list[Document]:
+def extract_page(html: str, url: str) -> Tuple[Document, List[str]]:
+    """Turn fetched HTML into a Document and the list of links found on the page."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Extract title
+    title = soup.title.string if soup.title and soup.title.string else "No title found"
+
+    # Collect links before navigation is stripped; menus are the main source of links
+    links = []
+    for link in soup.find_all('a', href=True):
+        href = normalize_url(url, link['href'])
+        if href:
+            links.append(href)
+
+    # Remove navigation menus and irrelevant elements
+    for nav in soup.find_all(['nav', 'header', 'footer']):
+        nav.decompose()
+
+    # Extract main content
+    main_content = soup.find('main') or soup.find('article') or soup.find('div', class_=re.compile('content|main'))
+    if not main_content:
+        main_content = soup.body or soup
+
+    content = []
+    for element in main_content.find_all(['h1', 'h2', 'h3', 'p', 'ul', 'li']):
+        text = element.get_text(strip=True)
+        if text and not text.startswith(('Select Page', 'Home')):
+            content.append(text)
+
+    content_text = "\n".join(content) or "No content available"
+
+    document = Document(
+        page_content=f"Title: {title}\n{content_text}",
+        metadata={"source": url, "title": title}
+    )
+    return document, links
+
+async def crawl_website(url: str, max_pages: int, depth: int,
+                        frontier: Optional[CrawlFrontier] = None) -> AsyncGenerator[List[Document], None]:
+    """
+    Crawl a site breadth-first and yield fetched pages in batches.
+
+    URLs are seeded from the root page and the site's sitemaps, filtered by robots.txt,
+    and tracked in a persisted CrawlFrontier. Each batch is marked done only after the
+    consumer resumes the generator, i.e. after it has been indexed. After
+    crawler_max_consecutive_failures failed fetches in a row (the site is down or
+    blocking us) the crawl stops as interrupted so it can be resumed later.
+    """
+    owns_frontier = frontier is None
+    if owns_frontier:
+        frontier = CrawlFrontier(url)
+        frontier.open(max_pages, depth)
+    batch_size = settings.crawler_batch_size
+
     try:
-        async with AsyncWebCrawler() as crawler:
-            # Crawl the main URL
-            result = await crawler.arun(
-                url=url,
-                max_depth=depth,
-                max_pages=max_pages,
-                extract_blocks=True,
-                bypass_cache=True,
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36",
-                js=False
-            )
-            
-            if not result.success or not result.html:
-                logger.error(f"Failed to crawl {url}: {result.status}")
-                return []
-            
-            # Parse HTML with BeautifulSoup
-            soup = BeautifulSoup(result.html, 'html.parser')
-            
-            # Extract title
-            title = soup.title.string if soup.title else "No title found"
-            
-            # Remove navigation menus and irrelevant elements
-            for nav in soup.find_all(['nav', 'header', 'footer']):
-                nav.decompose()
-            
-            # Extract main content
-            main_content = soup.find('main') or soup.find('article') or soup.find('div', class_=re.compile('content|main'))
-            if not main_content:
-                main_content = soup.body
-            
-            content = []
-            for element in main_content.find_all(['h1', 'h2', 'h3', 'p', 'ul', 'li']):
-                text = element.get_text(strip=True)
-                if text and not text.startswith(('Select Page', 'Home')):
-                    content.append(text)
-            
-            content_text = "\n".join(content) or "No content available"
-            
-            documents = [
-                Document(
-                    page_content=f"Title: {title}\n{content_text}",
-                    metadata={"source": url, "title": title}
-                )
-            ]
-            
-            # Crawl project pages (e.g., those containing "accessible-")
-            project_links = set()
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                if 'accessible-' in href.lower() and href.startswith('https://zendalona.com'):
-                    project_links.add(href)
-            
-            for project_url in project_links:
-                if len(documents) >= max_pages:
+        async with make_session() as session, AsyncWebCrawler() as crawler:
+            robots = await load_robots(session, url)
+            frontier.add([url], 0)
+            sitemap_urls = await discover_sitemap_urls(session, url, robots, limit=max_pages)
+            frontier.add([u for u in sitemap_urls if robots.can_fetch(USER_AGENT, u)], 1)
+
+            pages_done = frontier.count(DONE)
+            consecutive_failures = 0
+            interrupted = False
+            batch: List[Document] = []
+            while pages_done + len(batch) < max_pages:
+                wanted = min(settings.crawler_concurrency, max_pages - pages_done - len(batch))
+                pending = frontier.next_pending(wanted)
+                if not pending:
                     break
-                project_result = await crawler.arun(
-                    url=project_url,
-                    user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36",
-                    js=False
+
+                results = await asyncio.gather(
+                    *[crawler.arun(url=page_url, bypass_cache=True, user_agent=USER_AGENT, js=False)
+                      for page_url, _ in pending],
+                    return_exceptions=True
                 )
-                if project_result.success and project_result.html:
-                    project_soup = BeautifulSoup(project_result.html, 'html.parser')
-                    project_title = project_soup.title.string if project_soup.title else "No title found"
-                    for nav in project_soup.find_all(['nav', 'header', 'footer']):
-                        nav.decompose()
-                    project_main = project_soup.find('main') or project_soup.find('article') or project_soup.find('div', class_=re.compile('content|main')) or project_soup.body
-                    project_content = []
-                    for element in project_main.find_all(['h1', 'h2', 'h3', 'p', 'ul', 'li']):
-                        text = element.get_text(strip=True)
-                        if text and not text.startswith(('Select Page', 'Home')):
-                            project_content.append(text)
-                    project_content_text = "\n".join(project_content) or "No content available"
-                    documents.append(
-                        Document(
-                            page_content=f"Title: {project_title}\n{project_content_text}",
-                            metadata={"source": project_url, "title": project_title}
+
+                failed = []
+                for (page_url, page_depth), result in zip(pending, results):
+                    if isinstance(result, Exception) or not result.success or not result.html:
+                        reason = result if isinstance(result, Exception) else result.status_code
+                        logger.error(f"Failed to crawl {page_url}: {reason}")
+                        failed.append(page_url)
+                        consecutive_failures += 1
+                        continue
+                    consecutive_failures = 0
+                    document, links = extract_page(result.html, page_url)
+                    batch.append(document)
+                    if page_depth < depth:
+                        frontier.add(
+                            [link for link in links
+                             if same_site(url, link) and robots.can_fetch(USER_AGENT, link)],
+                            page_depth + 1
                         )
-                    )
-                    logger.info(f"Successfully crawled project page {project_url}")
-            
-            logger.info(f"Crawled {len(documents)} pages from {url}")
-            return documents
+                frontier.fail(failed)
+                if consecutive_failures >= settings.crawler_max_consecutive_failures:
+                    logger.error(f"Stopping crawl of {url} after {consecutive_failures} failed fetches in a row")
+                    interrupted = True
+                    break
+
+                if len(batch) >= batch_size:
+                    yield batch
+                    frontier.mark([doc.metadata["source"] for doc in batch], DONE)
+                    pages_done += len(batch)
+                    logger.info(f"Checkpointed {pages_done} pages from {url}")
+                    batch = []
+
+            if batch:
+                yield batch
+                frontier.mark([doc.metadata["source"] for doc in batch], DONE)
+                pages_done += len(batch)
+
+            if interrupted:
+                frontier.finish("interrupted")
+            elif frontier.count(PENDING):
+                # Stopped at max_pages; posting again with a larger max_pages continues it
+                frontier.finish("limited")
+            else:
+                frontier.finish("complete")
+            logger.info(f"Crawled {pages_done} pages from {url} ({frontier.count(FAILED)} failed)")
     except Exception as e:
         logger.error(f"Error crawling {url}: {str(e)}")
-        return []
+        raise
+    finally:
+        if owns_frontier:
+            frontier.close()
 
-async def process_and_index_url(url: str, max_pages: int, depth: int) -> int:
-    documents = await crawl_website(url, max_pages, depth)
-    return index_documents_to_chroma(documents, collection_name="zendalona")
\ No newline at end of file
+async def process_and_index_url(url: str, max_pages: int, depth: int, restart: bool = False) -> dict:
+    """
+    Crawl `url` and index pages batch by batch, resuming an interrupted crawl unless `restart` is set.
+
+    Returns documents_indexed, duplicates_skipped, status ("complete", "limited" or
+    "interrupted"), pages_pending and pages_failed. A limited or interrupted crawl
+    resumes when the same URL is posted again.
+    Raises CrawlInProgress if the URL is already being crawled.
+    """
+    frontier = CrawlFrontier(url)
+    try:
+        resumed = frontier.open(max_pages, depth, restart=restart)
+        documents_indexed = 0
+        duplicates_skipped = 0
+        try:
+            async with aclosing(crawl_website(url, max_pages, depth, frontier=frontier)) as batches:
+                async for batch in batches:
+                    indexed, skipped = await index_documents_to_chroma(batch, collection_name="zendalona")
+                    documents_indexed += indexed
+                    duplicates_skipped += skipped
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Crawl of {url} interrupted after {documents_indexed} documents: {str(e)}")
+        if resumed:
+            logger.info(f"Resumed crawl of {url} indexed {documents_indexed} more documents")
+        return {
+            "documents_indexed": documents_indexed,
+            "duplicates_skipped": duplicates_skipped,
+            "status": frontier.status() if frontier.status() in ("complete", "limited") else "interrupted",
+            "pages_pending": frontier.count(PENDING) + frontier.count(FETCHED),
+            "pages_failed": frontier.count(FAILED),
+        }
+    finally:
+        frontier.close()
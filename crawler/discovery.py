@@ -0,0 +1,106 @@
+import gzip
+import logging
+from typing import List, Optional, Set
+from urllib.parse import urljoin, urldefrag, urlparse
+from urllib.robotparser import RobotFileParser
+import aiohttp
+from lxml import etree
+from config import settings
+
+# Setup logging
+logging.basicConfig(filename=settings.log_path, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36"
+
+# Links to these are not HTML pages and are never queued
+SKIPPED_EXTENSIONS = (
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".ico", ".css", ".js",
+    ".zip", ".gz", ".tar", ".mp3", ".mp4", ".avi", ".mov", ".woff", ".woff2", ".xml",
+)
+
+# Upper bound on nested sitemap files fetched from a sitemap index
+MAX_SITEMAP_FILES = 50
+
+
+def normalize_url(base: str, href: str) -> Optional[str]:
+    """Resolve `href` against `base`, drop the fragment, and reject non-page links."""
+    url, _ = urldefrag(urljoin(base, href.strip()))
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        return None
+    if parsed.path.lower().endswith(SKIPPED_EXTENSIONS):
+        return None
+    return url
+
+
+def same_site(root_url: str, url: str) -> bool:
+    return urlparse(root_url).netloc.lower() == urlparse(url).netloc.lower()
+
+
+async def _fetch_text(session: aiohttp.ClientSession, url: str) -> Optional[str]:
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None
+            body = await response.read()
+            if url.endswith(".gz") or body[:2] == b"\x1f\x8b":
+                body = gzip.decompress(body)
+            return body.decode("utf-8", errors="replace")
+    except Exception as e:
+        logger.warning(f"Could not fetch {url}: {str(e)}")
+        return None
+
+
+async def load_robots(session: aiohttp.ClientSession, root_url: str) -> RobotFileParser:
+    """Fetch and parse robots.txt; a missing file allows everything."""
+    parsed = urlparse(root_url)
+    robots = RobotFileParser(f"{parsed.scheme}://{parsed.netloc}/robots.txt")
+    text = await _fetch_text(session, robots.url)
+    robots.parse(text.splitlines() if text else [])
+    return robots
+
+
+async def discover_sitemap_urls(session: aiohttp.ClientSession, root_url: str,
+                                robots: RobotFileParser, limit: int) -> List[str]:
+    """Collect up to `limit` same-site page URLs from the sitemaps listed in robots.txt (or /sitemap.xml)."""
+    parsed = urlparse(root_url)
+    to_visit = list(robots.site_maps() or []) or [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"]
+    seen_sitemaps: Set[str] = set()
+    pages: List[str] = []
+
+    while to_visit and len(seen_sitemaps) < MAX_SITEMAP_FILES and len(pages) < limit:
+        sitemap_url = to_visit.pop(0)
+        if sitemap_url in seen_sitemaps:
+            continue
+        seen_sitemaps.add(sitemap_url)
+        text = await _fetch_text(session, sitemap_url)
+        if not text:
+            continue
+        try:
+            root = etree.fromstring(text.encode("utf-8"), parser=etree.XMLParser(recover=True))
+        except etree.XMLSyntaxError as e:
+            logger.warning(f"Invalid sitemap {sitemap_url}: {str(e)}")
+            continue
+        if root is None:
+            continue
+        locs = [loc.text.strip() for loc in root.iter("{*}loc") if loc.text]
+        if etree.QName(root).localname == "sitemapindex":
+            to_visit.extend(locs)
+            continue
+        for loc in locs:
+            url = normalize_url(root_url, loc)
+            if url and same_site(root_url, url):
+                pages.append(url)
+                if len(pages) >= limit:
+                    break
+
+    logger.info(f"Discovered {len(pages)} URLs from {len(seen_sitemaps)} sitemap(s) for {root_url}")
+    return pages
+
+
+def make_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        headers={"User-Agent": USER_AGENT},
+        timeout=aiohttp.ClientTimeout(total=30),
+    )
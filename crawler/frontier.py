@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Iterable, List, Tuple
+from config import settings
+
+# Setup logging
+logging.basicConfig(filename=settings.log_path, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# URL states: pending -> fetched (held in memory, not yet indexed) -> done | failed
+PENDING = "pending"
+FETCHED = "fetched"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawls (
+    crawl_id TEXT PRIMARY KEY,
+    root_url TEXT NOT NULL,
+    max_pages INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    crawl_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (crawl_id, url)
+);
+CREATE INDEX IF NOT EXISTS frontier_pending ON frontier (crawl_id, status, depth);
+"""
+
+# crawl_ids currently open in this process; a second crawl of the same root is refused
+_open_crawls = set()
+
+
+class CrawlInProgress(RuntimeError):
+    """Raised when a crawl of the same root URL is already running."""
+
+
+class CrawlFrontier:
+    """
+    Crawl frontier and visited set for one root URL, persisted in SQLite.
+
+    Every URL ever queued stays in the `frontier` table, so the table doubles as the
+    visited set. A URL is only marked done after its page has been indexed, which lets
+    an interrupted crawl resume from the last indexed batch.
+    """
+
+    def __init__(self, root_url: str, path: str = None):
+        self.root_url = root_url
+        self.crawl_id = hashlib.sha1(root_url.encode("utf-8")).hexdigest()
+        self.path = path or settings.crawl_state_path
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(frontier)")}
+        if "attempts" not in columns:
+            # State files written before failed fetches were retried
+            with self.conn:
+                self.conn.execute("ALTER TABLE frontier ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._owned = False
+
+    def open(self, max_pages: int, depth: int, restart: bool = False) -> bool:
+        """
+        Start or resume the crawl. Returns True if an unfinished crawl was resumed.
+
+        On resume, failed URLs are queued again until they have failed crawler_max_attempts times.
+
+        Raises CrawlInProgress if another crawl of the same root URL is running.
+        """
+        if self.crawl_id in _open_crawls:
+            raise CrawlInProgress(f"A crawl of {self.root_url} is already running")
+        _open_crawls.add(self.crawl_id)
+        self._owned = True
+        row = self.conn.execute(
+            "SELECT status FROM crawls WHERE crawl_id = ?", (self.crawl_id,)
+        ).fetchone()
+        now = time.time()
+        # Limited and interrupted crawls resume, as does one left "running" by a dead process
+        resumed = row is not None and row[0] != "complete" and not restart
+        with self.conn:
+            if resumed:
+                # Pages fetched but never indexed were lost with the previous process
+                self.conn.execute(
+                    "UPDATE frontier SET status = ? WHERE crawl_id = ? AND status = ?",
+                    (PENDING, self.crawl_id, FETCHED),
+                )
+                self.conn.execute(
+                    "UPDATE frontier SET status = ? WHERE crawl_id = ? AND status = ? AND attempts < ?",
+                    (PENDING, self.crawl_id, FAILED, settings.crawler_max_attempts),
+                )
+                self.conn.execute(
+                    "UPDATE crawls SET max_pages = ?, depth = ?, status = 'running', updated_at = ? WHERE crawl_id = ?",
+                    (max_pages, depth, now, self.crawl_id),
+                )
+            else:
+                self.conn.execute("DELETE FROM frontier WHERE crawl_id = ?", (self.crawl_id,))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO crawls VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                    (self.crawl_id, self.root_url, max_pages, depth, now, now),
+                )
+        if resumed:
+            logger.info(f"Resuming crawl of {self.root_url}: {self.count(DONE)} pages already indexed")
+        return resumed
+
+    def add(self, urls: Iterable[str], depth: int) -> None:
+        """Queue URLs that have not been seen before in this crawl."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO frontier (crawl_id, url, depth, status) VALUES (?, ?, ?, ?)",
+                [(self.crawl_id, url, depth, PENDING) for url in urls],
+            )
+
+    def next_pending(self, limit: int) -> List[Tuple[str, int]]:
+        """Pop up to `limit` pending URLs, shallowest first, and mark them fetched."""
+        rows = self.conn.execute(
+            "SELECT url, depth FROM frontier WHERE crawl_id = ? AND status = ? ORDER BY depth, rowid LIMIT ?",
+            (self.crawl_id, PENDING, limit),
+        ).fetchall()
+        self.mark([url for url, _ in rows], FETCHED)
+        return rows
+
+    def mark(self, urls: Iterable[str], status: str) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE frontier SET status = ? WHERE crawl_id = ? AND url = ?",
+                [(status, self.crawl_id, url) for url in urls],
+            )
+            self.conn.execute(
+                "UPDATE crawls SET updated_at = ? WHERE crawl_id = ?", (time.time(), self.crawl_id)
+            )
+
+    def fail(self, urls: Iterable[str]) -> None:
+        """Mark URLs failed and count the attempt against crawler_max_attempts."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE frontier SET status = ?, attempts = attempts + 1 WHERE crawl_id = ? AND url = ?",
+                [(FAILED, self.crawl_id, url) for url in urls],
+            )
+
+    def count(self, status: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM frontier WHERE crawl_id = ? AND status = ?", (self.crawl_id, status)
+        ).fetchone()[0]
+
+    def status(self) -> str:
+        row = self.conn.execute(
+            "SELECT status FROM crawls WHERE crawl_id = ?", (self.crawl_id,)
+        ).fetchone()
+        return row[0] if row else "unknown"
+
+    def finish(self, status: str = "complete") -> None:
+        """
+        Record how the crawl ended: "complete" once the frontier is empty, or "limited"
+        (stopped at max_pages) or "interrupted", both of which are resumed by open().
+        """
+        with self.conn:
+            self.conn.execute(
+                "UPDATE crawls SET status = ?, updated_at = ? WHERE crawl_id = ?",
+                (status, time.time(), self.crawl_id),
+            )
+
+    def close(self) -> None:
+        if self._owned:
+            _open_crawls.discard(self.crawl_id)
+            self._owned = False
+        self.conn.close()
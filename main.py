@@ -17,6 +17,7 @@ from routers import chat, indexing, system
 from utils.langchain_utils import get_rag_chain, process_query, get_streaming_chain
 from utils.chroma_utils import process_pdf, index_documents_to_chroma
 from crawler.crawler import process_and_index_url
+from utils.profiling import ProfilingMiddleware, start_stall_detector, stop_stall_detector
 from config import settings
 
 # Setup logging
@@ -44,11 +45,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in request profiling (see /system/profile); a no-op unless armed
+app.add_middleware(ProfilingMiddleware)
+
 # Include routers
 app.include_router(chat.router)
 app.include_router(indexing.router)
 app.include_router(system.router)
 
+@app.on_event("startup")
+async def start_loop_monitoring():
+    if settings.loop_stall_threshold_ms > 0:
+        start_stall_detector(settings.loop_stall_threshold_ms)
+
+@app.on_event("shutdown")
+async def stop_loop_monitoring():
+    stop_stall_detector()
+
 # Custom OpenAPI endpoint
 @app.get("/openapi.json", include_in_schema=False)
 async def get_open_api_endpoint():
@@ -2,10 +2,16 @@ from fastapi import APIRouter, HTTPException, Depends, Body
 from fastapi.responses import JSONResponse
 from sse_starlette.sse import EventSourceResponse
 from typing import Dict, Any, AsyncGenerator, Optional, List
-from utils.models import ChatRequest, ChatResponse, StreamingChatRequest
-from utils.langchain_utils import get_rag_chain, process_query, get_streaming_chain
+from utils.models import ChatRequest, ChatResponse, StreamingChatRequest, PrefetchRequest, PrefetchResponse
+from utils.langchain_utils import get_rag_chain, get_retriever, process_query, get_streaming_chain
+from utils.rate_limiter import (
+    AdmissionRejected, Priority, llm_limiter, embedding_limiter, call_with_retry, stream_with_retry,
+)
+from utils.profiling import profile_stage, record_stage
+from utils.prefetch import prefetch_cache
 import logging
 import asyncio
+from contextlib import aclosing
 import uuid
 import time
 
@@ -29,10 +35,23 @@ async def chat(request: ChatRequest):
     - **session_id**: Optional unique identifier for the chat session
     """
     try:
-        chain = get_rag_chain()
-        response, sources = process_query(chain, request.query)
+        with profile_stage("chain_build"):
+            chain = get_rag_chain()
+            retriever = get_retriever()
+        
+        # Retrieval and generation are admitted separately so neither holds the other's slot
+        with profile_stage("retrieval"):
+            docs = await call_with_retry(
+                embedding_limiter, lambda: asyncio.to_thread(retriever.get_relevant_documents, request.query)
+            )
+        response, sources = await call_with_retry(
+            llm_limiter, lambda: asyncio.to_thread(process_query, chain, request.query, docs)
+        )
         logging.info(f"Processed query: {request.query}")
         return ChatResponse(response=response, sources=sources)
+    except AdmissionRejected as e:
+        logging.warning(f"Shed chat query: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logging.error(f"Error processing chat query: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -41,10 +60,17 @@ async def stream_response(query: str, session_id: str) -> AsyncGenerator[dict, N
     """Generate a streaming response for the chat query."""
     try:
         # Initialize the RAG chain with streaming capability
-        chain, retriever = get_streaming_chain()
+        with profile_stage("chain_build"):
+            chain, retriever = get_streaming_chain()
         
-        # Retrieve documents based on the query
-        docs = retriever.get_relevant_documents(query)
+        # Reuse a speculative retrieval from /chat/prefetch, otherwise retrieve now
+        with profile_stage("prefetch_lookup"):
+            docs = await prefetch_cache.take(session_id, query)
+        if docs is None:
+            with profile_stage("retrieval"):
+                docs = await call_with_retry(
+                    embedding_limiter, lambda: asyncio.to_thread(retriever.get_relevant_documents, query)
+                )
         sources = [doc.metadata.get("source", "") for doc in docs if doc.metadata.get("source")]
         
         # Track the session
@@ -56,12 +82,20 @@ async def stream_response(query: str, session_id: str) -> AsyncGenerator[dict, N
         # Stream the response
         context = "\n\n".join([doc.page_content for doc in docs]) if docs else ""
         
-        async for chunk in chain.astream({"context": context, "question": query}):
-            if hasattr(chunk, "content"):
-                yield {"event": "message", "data": chunk.content}
-            else:
-                yield {"event": "message", "data": str(chunk)}
-            await asyncio.sleep(0.01)  # Small delay to control flow
+        llm_started = time.perf_counter()
+        first = True
+        stream = stream_with_retry(llm_limiter, lambda: chain.astream({"context": context, "question": query}))
+        async with aclosing(stream):
+            async for chunk in stream:
+                if first:
+                    record_stage("llm_first_token", time.perf_counter() - llm_started)
+                    first = False
+                if hasattr(chunk, "content"):
+                    yield {"event": "message", "data": chunk.content}
+                else:
+                    yield {"event": "message", "data": str(chunk)}
+                await asyncio.sleep(0.01)  # Small delay to control flow
+        record_stage("llm", time.perf_counter() - llm_started)
         
         # Send sources as the final event
         yield {"event": "sources", "data": ",".join(sources)}
@@ -69,6 +103,9 @@ async def stream_response(query: str, session_id: str) -> AsyncGenerator[dict, N
         # Send completion event
         yield {"event": "done", "data": ""}
         
+    except AdmissionRejected as e:
+        logging.warning(f"Shed streaming query: {str(e)}")
+        yield {"event": "error", "data": str(e)}
     except Exception as e:
         logging.error(f"Error in streaming response: {str(e)}")
         yield {"event": "error", "data": str(e)}
@@ -89,11 +126,37 @@ async def stream_chat(request: StreamingChatRequest):
     if not request.session_id:
         request.session_id = str(uuid.uuid4())
     
+    # Shed load up front so clients get a real 503 instead of an error event
+    for limiter in (embedding_limiter, llm_limiter):
+        if limiter.is_saturated(Priority.INTERACTIVE):
+            raise HTTPException(status_code=503, detail=f"{limiter.name} is overloaded, try again later",
+                                headers={"Retry-After": "1"})
+    
     return EventSourceResponse(
         stream_response(request.query, request.session_id),
         media_type="text/event-stream"
     )
 
+@router.post(
+    "/prefetch",
+    response_model=PrefetchResponse,
+    status_code=202,
+    summary="Speculatively retrieve context while the user types",
+    description="Start embedding and retrieval for a partial query so a following /chat/stream call in the same session can skip them",
+    response_description="Whether the prefetch was scheduled, already cached or skipped",
+)
+async def prefetch(request: PrefetchRequest):
+    """
+    Speculatively run retrieval for a partially typed query. Call it debounced while the
+    user types, then send /chat/stream with the same session ID. Prefetches are skipped
+    whenever Gemini capacity is needed for real requests.
+    
+    - **query**: The partially typed question
+    - **session_id**: Session identifier used by the following /chat/stream call
+    """
+    status = prefetch_cache.schedule(request.session_id, request.query)
+    return PrefetchResponse(status=status, session_id=request.session_id)
+
 @router.delete(
     "/sessions/{session_id}",
     summary="Delete a chat session",
@@ -3,6 +3,8 @@ from typing import List, Optional
 from utils.models import CrawlRequest, CrawlResponse, PdfUploadResponse
 from utils.chroma_utils import process_pdf, index_documents_to_chroma
 from crawler.crawler import process_and_index_url
+from crawler.frontier import CrawlInProgress
+from utils.rate_limiter import AdmissionRejected
 import logging
 from io import BytesIO
 router = APIRouter(prefix="/indexing", tags=["Indexing"])
@@ -21,14 +23,30 @@ async def crawl(request: CrawlRequest):
     - **url**: The URL to crawl
     - **max_pages**: Maximum number of pages to crawl (default: 10)
     - **depth**: Maximum crawl depth (default: 2)
+    - **restart**: Start over instead of resuming a limited or interrupted crawl of the same URL (default: false)
     """
     try:
-        documents_indexed = await process_and_index_url(
-            str(request.url), request.max_pages, request.depth
+        result = await process_and_index_url(
+            str(request.url), request.max_pages, request.depth, restart=request.restart
         )
-        message = f"Successfully crawled and indexed {documents_indexed} documents from {request.url}"
+        if result["status"] == "complete":
+            message = (f"Successfully crawled and indexed {result['documents_indexed']} documents from {request.url}"
+                       f" ({result['duplicates_skipped']} near-duplicates skipped, {result['pages_failed']} pages failed)")
+        elif result["status"] == "limited":
+            message = (f"Crawled and indexed {result['documents_indexed']} documents from {request.url} and reached"
+                       f" max_pages with {result['pages_pending']} pages pending. Post the same URL with a larger"
+                       f" max_pages to continue")
+        else:
+            message = (f"Crawl of {request.url} was interrupted after indexing {result['documents_indexed']} documents;"
+                       f" {result['pages_pending']} pages pending, {result['pages_failed']} failed."
+                       f" Post the same URL again to resume")
         logging.info(message)
-        return CrawlResponse(message=message, documents_indexed=documents_indexed)
+        return CrawlResponse(message=message, **result)
+    except CrawlInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except AdmissionRejected as e:
+        logging.warning(f"Shed crawl of {request.url}: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logging.error(f"Error crawling {request.url}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -59,11 +77,18 @@ async def upload_pdf(
         documents = process_pdf(BytesIO(content), file.filename)
         
         # Index documents in ChromaDB
-        documents_indexed = index_documents_to_chroma(documents, collection_name=collection_name)
+        documents_indexed, duplicates_skipped = await index_documents_to_chroma(documents, collection_name=collection_name)
         
-        message = f"Successfully processed and indexed {documents_indexed} pages from PDF: {file.filename}"
+        message = (f"Successfully processed and indexed {documents_indexed} pages from PDF: {file.filename}"
+                   f" ({duplicates_skipped} near-duplicates skipped)")
         logging.info(message)
-        return PdfUploadResponse(message=message, documents_indexed=documents_indexed)
+        return PdfUploadResponse(message=message, documents_indexed=documents_indexed,
+                                 duplicates_skipped=duplicates_skipped)
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        logging.warning(f"Shed PDF upload {file.filename}: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logging.error(f"Error processing PDF upload: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel
-from typing import Dict, Any
+from fastapi import APIRouter, Depends, Header, HTTPException
+from pydantic import BaseModel, Field
+from typing import Dict, Any, Optional
+import hmac
 import platform
 import psutil
 import os
 from config import settings
+from utils.rate_limiter import llm_limiter, embedding_limiter
+from utils.profiling import profiler, start_stall_detector, stop_stall_detector
+from utils.prefetch import prefetch_cache
 
 router = APIRouter(prefix="/system", tags=["System"])
 
@@ -22,6 +26,20 @@ class SystemInfoResponse(BaseModel):
     storage_info: Dict[str, Any]
     config: Dict[str, Any]
 
+class ProfileRequest(BaseModel):
+    requests: Optional[int] = Field(default=None, ge=1, le=1000,
+                                   description="Profile the next N requests")
+    seconds: Optional[float] = Field(default=None, gt=0, le=600,
+                                    description="Profile everything within a time window")
+    stall_threshold_ms: Optional[float] = Field(default=None, ge=0,
+                                               description="Log the event loop stack when it is blocked longer than this (0 turns the detector off)")
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="Profiling is disabled; set ADMIN_TOKEN to enable it")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode("utf-8"), settings.admin_token.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
 @router.get(
     "/health",
     response_model=HealthResponse,
@@ -55,7 +73,13 @@ async def system_info():
         "log_path": settings.log_path,
         "crawler_depth": settings.crawler_depth,
         "crawler_max_pages": settings.crawler_max_pages,
-        "document_store_path": settings.document_store_path
+        "crawler_concurrency": settings.crawler_concurrency,
+        "crawl_state_path": settings.crawl_state_path,
+        "document_store_path": settings.document_store_path,
+        "gemini_llm_rpm": settings.gemini_llm_rpm,
+        "gemini_embedding_rpm": settings.gemini_embedding_rpm,
+        "gemini_max_concurrency": settings.gemini_max_concurrency,
+        "admission_queue_size": settings.admission_queue_size
     }
     
     return {
@@ -76,4 +100,78 @@ async def system_info():
             "percent": disk.percent
         },
         "config": safe_settings
-    }
\ No newline at end of file
+    }
+
+@router.get(
+    "/admission",
+    summary="Gemini admission control stats",
+    description="Queue depth, in-flight calls and wait times for the Gemini LLM and embedding limiters",
+    response_description="Admission control statistics per limiter",
+)
+async def admission_stats():
+    """
+    Get queue depth, wait times and shedding counters for the Gemini admission controllers.
+    """
+    return {
+        "llm": llm_limiter.stats(),
+        "embedding": embedding_limiter.stats(),
+        "prefetch": prefetch_cache.stats(),
+    }
+
+@router.post(
+    "/profile",
+    summary="Start a profiling session",
+    description="Sample-profile the next N requests or a time window and write speedscope, flamegraph and stage timing files",
+    response_description="The armed profiling session",
+    dependencies=[Depends(require_admin)],
+)
+async def start_profile(request: ProfileRequest):
+    """
+    Start an on-demand profiling session. Requires the `X-Admin-Token` header.
+
+    - **requests**: Profile the next N requests
+    - **seconds**: Profile all requests within this many seconds
+    - **stall_threshold_ms**: Optionally start (or with 0, stop) the event loop stall detector
+
+    A single request can also be profiled by sending the admin token in an `X-Profile` header.
+    """
+    if request.stall_threshold_ms is not None:
+        if request.stall_threshold_ms > 0:
+            start_stall_detector(request.stall_threshold_ms)
+        else:
+            stop_stall_detector()
+    if request.requests is None and request.seconds is None:
+        return profiler.status()
+    try:
+        profiler.arm(requests=request.requests, seconds=request.seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+@router.get(
+    "/profile",
+    summary="Profiling status",
+    description="Whether a profiling session is running and where the last one was written",
+    response_description="Profiling status",
+    dependencies=[Depends(require_admin)],
+)
+async def profile_status():
+    """
+    Get the state of the current profiling session and the files written by the last one.
+    """
+    return profiler.status()
+
+@router.delete(
+    "/profile",
+    summary="Stop the profiling session",
+    description="Stop the running profiling session early and write what was collected",
+    response_description="Profiling status",
+    dependencies=[Depends(require_admin)],
+)
+async def stop_profile():
+    """
+    Stop the running profiling session. Its output is written once in-flight profiled requests finish.
+    """
+    if not profiler.stop():
+        raise HTTPException(status_code=404, detail="No profiling session is running")
+    return profiler.status()
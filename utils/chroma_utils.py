@@ -1,8 +1,11 @@
+import asyncio
 import logging
 from langchain_chroma import Chroma
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain.schema import Document
 from config import settings
+from utils.rate_limiter import Priority, embedding_limiter, call_with_retry
+from utils.dedup import NearDuplicateIndex, minhash
 from PyPDF2 import PdfReader
 from io import BytesIO
 
@@ -20,25 +23,77 @@ def get_chroma_db(collection_name: str = "zendalona"):
         embedding_function=embeddings
     )
 
-def index_documents_to_chroma(documents: list[Document], collection_name: str = "zendalona") -> int:
+# GoogleGenerativeAIEmbeddings sends up to 100 texts per embedding request
+EMBED_BATCH_SIZE = 100
+
+def _live_sources(db, sources: list[str]) -> set[str]:
+    """Subset of `sources` that still has documents in the collection."""
+    found = db.get(where={"source": {"$in": sources}}, include=["metadatas"])
+    return {meta["source"] for meta in found["metadatas"] if "source" in meta}
+
+async def index_documents_to_chroma(documents: list[Document], collection_name: str = "zendalona") -> tuple[int, int]:
+    """
+    Index documents into ChromaDB, skipping already-indexed pages and near-duplicates.
+
+    Returns a tuple of (documents indexed, near-duplicates skipped).
+    """
     try:
         db = get_chroma_db(collection_name)
         
-        # Get existing document URLs/sources to avoid duplicates
-        existing_docs = db.get(include=["metadatas"])
-        existing_sources = {doc["source"] for doc in existing_docs["metadatas"] if "source" in doc}
+        # Get existing document URLs/sources to avoid duplicates; only look up this
+        # batch's sources so large crawls don't re-read the whole collection per batch
+        sources = list({doc.metadata["source"] for doc in documents if doc.metadata.get("source")})
+        existing_docs = db.get(where={"source": {"$in": sources}}, include=["metadatas"]) if sources else {"metadatas": []}
+        # Keyed on (source, page) so a PDF whose later batches failed can be re-uploaded
+        # to index the missing pages; crawled pages have no page number
+        existing_keys = {
+            (meta["source"], meta.get("page")) for meta in existing_docs["metadatas"] if "source" in meta
+        }
         
-        # Filter out documents whose sources are already indexed
-        new_documents = [doc for doc in documents if doc.metadata.get("source") not in existing_sources]
+        # Filter out documents (pages) that are already indexed
+        new_documents = [
+            doc for doc in documents
+            if (doc.metadata.get("source"), doc.metadata.get("page")) not in existing_keys
+        ]
         
         if not new_documents:
-            logging.info("No new documents to index; all sources already exist in ChromaDB")
-            return 0
+            logging.info("No new documents to index; all of them already exist in ChromaDB")
+            return 0, 0
         
-        # Add new documents to ChromaDB
-        db.add_documents(new_documents)
+        # Drop near-duplicates of already-indexed content before paying for embeddings
+        duplicates = 0
+        dedup_index = None
+        if settings.dedup_enabled:
+            def deduplicate():
+                # MinHash, SQLite and the Chroma lookup all block; keep them off the event loop
+                index = NearDuplicateIndex(collection_name)
+                try:
+                    signatures = [minhash(doc.page_content) for doc in new_documents]
+                    kept, dropped = index.filter(new_documents, signatures, lambda matched: _live_sources(db, matched))
+                except Exception:
+                    index.close()
+                    raise
+                return index, kept, dropped
+
+            dedup_index, new_documents, duplicates = await asyncio.to_thread(deduplicate)
+            if duplicates:
+                logging.info(f"Skipped {duplicates} near-duplicate documents for collection '{collection_name}'")
+        
+        try:
+            # Add new documents to ChromaDB, one admitted embedding request per batch
+            for start in range(0, len(new_documents), EMBED_BATCH_SIZE):
+                batch = new_documents[start:start + EMBED_BATCH_SIZE]
+                await call_with_retry(
+                    embedding_limiter, lambda batch=batch: asyncio.to_thread(db.add_documents, batch),
+                    Priority.INGESTION
+                )
+                if dedup_index is not None:
+                    await asyncio.to_thread(dedup_index.commit, batch)
+        finally:
+            if dedup_index is not None:
+                dedup_index.close()
         logging.info(f"Indexed {len(new_documents)} new documents to ChromaDB collection '{collection_name}'")
-        return len(new_documents)
+        return len(new_documents), duplicates
     except Exception as e:
         logging.error(f"Error indexing documents: {str(e)}")
         raise
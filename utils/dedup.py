@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import os
+import random
+import re
+import sqlite3
+from array import array
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from langchain.schema import Document
+from config import settings
+
+# Setup logging
+logging.basicConfig(filename=settings.log_path, level=logging.INFO)
+
+# MinHash / LSH parameters. With 16 bands of 8 rows, pairs around 0.7 Jaccard
+# similarity become candidates; candidates are then checked against dedup_threshold.
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 64) - 1
+# Fixed seed: signatures are persisted and must be comparable across processes
+_rng = random.Random(1337)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)
+]
+
+_WORD_RE = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    collection TEXT NOT NULL,
+    doc_key TEXT NOT NULL,
+    source TEXT,
+    signature BLOB NOT NULL,
+    PRIMARY KEY (collection, doc_key)
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    collection TEXT NOT NULL,
+    band INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    doc_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lsh_lookup ON lsh_buckets (collection, band, bucket);
+"""
+
+# Created separately so index files written before it existed can be cleaned up first
+UNIQUE_BUCKETS = "CREATE UNIQUE INDEX IF NOT EXISTS lsh_unique ON lsh_buckets (collection, band, doc_key)"
+
+
+def _stable_hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def shingles(text: str) -> set:
+    """Word n-gram shingles of `text`, hashed to 64-bit ints."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {_stable_hash(" ".join(words).encode("utf-8"))} if words else set()
+    return {
+        _stable_hash(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"))
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash(text: str) -> List[int]:
+    """MinHash signature of `text` with NUM_PERM permutations."""
+    hashed = shingles(text)
+    if not hashed:
+        return [_MAX_HASH] * NUM_PERM
+    return [
+        min((a * h + b) % _MERSENNE_PRIME for h in hashed)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _band_buckets(signature: List[int]) -> List[str]:
+    return [
+        hashlib.blake2b(array("Q", signature[i * ROWS:(i + 1) * ROWS]).tobytes(), digest_size=8).hexdigest()
+        for i in range(BANDS)
+    ]
+
+
+class NearDuplicateIndex:
+    """
+    Persisted MinHash LSH index of everything indexed into a Chroma collection.
+
+    `filter` drops documents that are near-duplicates of indexed content (or of an
+    earlier document in the same call) and stages the rest; `commit` records staged
+    documents batch by batch as they are actually written to Chroma.
+
+    All methods block on SQLite (and `filter` on the `live_sources` callback); create
+    and use the index from worker threads, one call at a time.
+    """
+
+    def __init__(self, collection_name: str, path: Optional[str] = None, threshold: Optional[float] = None):
+        self.collection = collection_name
+        self.path = path or settings.dedup_index_path
+        self.threshold = settings.dedup_threshold if threshold is None else threshold
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Calls arrive from whichever asyncio.to_thread worker runs them, never concurrently
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        if not self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'lsh_unique'"
+        ).fetchone():
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM lsh_buckets WHERE rowid NOT IN "
+                    "(SELECT MIN(rowid) FROM lsh_buckets GROUP BY collection, band, doc_key)"
+                )
+                self.conn.execute(UNIQUE_BUCKETS)
+        self._staged: List[Tuple[Document, str, str, List[int], List[str]]] = []
+
+    def _candidates(self, buckets: List[str]) -> Dict[str, Tuple[str, List[int]]]:
+        rows = self.conn.execute(
+            "SELECT DISTINCT s.doc_key, s.source, s.signature FROM lsh_buckets b "
+            "JOIN signatures s ON s.collection = b.collection AND s.doc_key = b.doc_key "
+            f"WHERE b.collection = ? AND ({' OR '.join(['(b.band = ? AND b.bucket = ?)'] * BANDS)})",
+            [self.collection] + [value for band, bucket in enumerate(buckets) for value in (band, bucket)],
+        ).fetchall()
+        return {key: (source, list(array("Q", blob))) for key, source, blob in rows}
+
+    def filter(self, documents: List[Document], signatures: List[List[int]],
+               live_sources: Callable[[List[str]], Set[str]]) -> Tuple[List[Document], int]:
+        """
+        Return (documents to index, number of near-duplicates dropped).
+
+        `live_sources` maps candidate sources to those still present in the collection;
+        fingerprints of sources that have disappeared (e.g. a rebuilt chroma_db) are
+        forgotten instead of counting as matches.
+        """
+        persisted = []
+        for signature in signatures:
+            candidates = self._candidates(_band_buckets(signature))
+            persisted.append({
+                key: source for key, (source, other) in candidates.items()
+                if similarity(signature, other) >= self.threshold
+            })
+        matched_sources = sorted({source for matches in persisted for source in matches.values()})
+        live = live_sources(matched_sources) if matched_sources else set()
+        stale = {key for matches in persisted for key, source in matches.items() if source not in live}
+        if stale:
+            self._forget(stale)
+
+        kept = []
+        dropped = 0
+        for doc, signature, matches in zip(documents, signatures, persisted):
+            buckets = _band_buckets(signature)
+            match = next((source for source in matches.values() if source in live), None)
+            if match is None:
+                match = next(
+                    (source for _, _, source, staged_sig, staged_buckets in self._staged
+                     if any(a == b for a, b in zip(buckets, staged_buckets))
+                     and similarity(signature, staged_sig) >= self.threshold),
+                    None,
+                )
+            if match is not None:
+                dropped += 1
+                logging.info(
+                    f"Skipping near-duplicate of {match}: {doc.metadata.get('source')} "
+                    f"(page {doc.metadata.get('page', '-')})"
+                )
+                continue
+            kept.append(doc)
+            doc_key = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+            self._staged.append((doc, doc_key, doc.metadata.get("source", ""), signature, buckets))
+        return kept, dropped
+
+    def _forget(self, doc_keys: Set[str]) -> None:
+        logging.info(f"Forgetting {len(doc_keys)} fingerprints whose sources are no longer indexed")
+        with self.conn:
+            for table in ("signatures", "lsh_buckets"):
+                self.conn.executemany(
+                    f"DELETE FROM {table} WHERE collection = ? AND doc_key = ?",
+                    [(self.collection, key) for key in doc_keys],
+                )
+
+    def commit(self, documents: List[Document]) -> None:
+        """Persist fingerprints of `documents` (kept by `filter`) once they are written to Chroma."""
+        written = {id(doc) for doc in documents}
+        entries = [entry for entry in self._staged if id(entry[0]) in written]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO signatures VALUES (?, ?, ?, ?)",
+                [(self.collection, key, source, array("Q", sig).tobytes()) for _, key, source, sig, _ in entries],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO lsh_buckets VALUES (?, ?, ?, ?)",
+                [
+                    (self.collection, band, bucket, key)
+                    for _, key, _, _, buckets in entries
+                    for band, bucket in enumerate(buckets)
+                ],
+            )
+
+    def close(self) -> None:
+        self.conn.close()
@@ -1,16 +1,23 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import RetrievalQA, create_retrieval_chain
+from langchain.chains import create_retrieval_chain
 from langchain.prompts import PromptTemplate
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
 from config import settings
 from utils.chroma_utils import get_chroma_db
+from utils.profiling import stage_callbacks
 
 def get_rag_chain():
+    """
+    Create the answer-generation chain used by /chat: the Zendalona prompt stuffed with
+    already-retrieved documents. Retrieval is done separately (see get_retriever) so
+    each step can be admitted against its own Gemini quota.
+    """
     llm = ChatGoogleGenerativeAI(
         model="gemini-1.5-flash",
         google_api_key=settings.gemini_api_key,
-        temperature=0.2
+        temperature=0.2,
+        max_retries=1  # Retries are handled by utils.rate_limiter
     )
     
     prompt_template = """You are a helpful assistant for Zendalona, providing accurate answers about Zendalona products and general queries. If the question is related to Zendalona and the provided context is relevant, use the context to answer accurately. For questions unrelated to Zendalona or when the context is insufficient, provide a clear and accurate answer based on your general knowledge without mentioning the lack of context. Always be polite and accessible.
@@ -24,18 +31,8 @@ def get_rag_chain():
         input_variables=["context", "question"]
     )
     
-    db = get_chroma_db(collection_name="zendalona")
-    retriever = db.as_retriever(search_kwargs={"k": 5})
-    
-    chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=retriever,
-        return_source_documents=True,
-        chain_type_kwargs={"prompt": prompt}
-    )
-    
-    return chain
+    return create_stuff_documents_chain(llm, prompt)
+
 def get_streaming_chain():
     """
     Create a streaming-compatible LangChain chain
@@ -47,7 +44,8 @@ def get_streaming_chain():
         model="gemini-1.5-flash",
         google_api_key=settings.gemini_api_key,
         temperature=0.2,
-        streaming=True
+        streaming=True,
+        max_retries=1  # Retries are handled by utils.rate_limiter
     )
     
     # Define a simple template
@@ -69,14 +67,21 @@ def get_streaming_chain():
     chain = prompt | llm
     
     # Create a retriever
-    db = get_chroma_db(collection_name="zendalona")
-    retriever = db.as_retriever(search_kwargs={"k": 5})
+    retriever = get_retriever()
     
     # Return the chain and retriever separately
     return chain, retriever
 
-def process_query(chain, query: str):
-    result = chain({"query": query})
-    response = result["result"]
-    sources = [doc.metadata.get("source", "") for doc in result["source_documents"] if doc.metadata.get("source")]
+def get_retriever(k: int = 5):
+    """Retriever over the zendalona collection, as used by the streaming chain."""
+    db = get_chroma_db(collection_name="zendalona")
+    return db.as_retriever(search_kwargs={"k": k})
+
+def process_query(chain, query: str, docs):
+    """Answer `query` from already-retrieved `docs` with a get_rag_chain() chain."""
+    response = chain.invoke(
+        {"context": docs, "question": query},
+        config={"callbacks": stage_callbacks()}
+    )
+    sources = [doc.metadata.get("source", "") for doc in docs if doc.metadata.get("source")]
     return response, sources
\ No newline at end of file
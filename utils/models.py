@@ -30,6 +30,31 @@ class StreamingChatRequest(BaseModel):
             }
         }
 
+class PrefetchRequest(BaseModel):
+    query: str = Field(..., description="The partially typed question",
+                      example="What features do Zendalona")
+    session_id: str = Field(..., description="Session identifier that the following /chat/stream call will use")
+    
+    class Config:
+        schema_extra = {
+            "example": {
+                "query": "What features do Zendalona",
+                "session_id": "550e8400-e29b-41d4-a716-446655440000"
+            }
+        }
+
+class PrefetchResponse(BaseModel):
+    status: str = Field(..., description="One of 'scheduled', 'cached' or 'skipped'")
+    session_id: str = Field(..., description="Session identifier the prefetch is stored under")
+    
+    class Config:
+        schema_extra = {
+            "example": {
+                "status": "scheduled",
+                "session_id": "550e8400-e29b-41d4-a716-446655440000"
+            }
+        }
+
 class ChatResponse(BaseModel):
     response: str = Field(..., description="The AI-generated response")
     sources: List[str] = Field(default_factory=list, 
@@ -46,41 +71,56 @@ class ChatResponse(BaseModel):
 class CrawlRequest(BaseModel):
     url: HttpUrl = Field(..., description="The URL to crawl", 
                         example="https://example.com")
-    max_pages: int = Field(default=10, ge=1, le=100, 
+    max_pages: int = Field(default=10, ge=1, le=50000, 
                           description="Maximum number of pages to crawl")
     depth: int = Field(default=2, ge=1, le=5, 
                       description="Maximum crawl depth")
+    restart: bool = Field(default=False,
+                         description="Discard saved progress instead of resuming a limited or interrupted crawl")
     
     class Config:
         schema_extra = {
             "example": {
                 "url": "https://example.com",
                 "max_pages": 15,
-                "depth": 2
+                "depth": 2,
+                "restart": False
             }
         }
 
 class CrawlResponse(BaseModel):
     message: str = Field(..., description="Status message about the crawl operation")
     documents_indexed: int = Field(..., description="Number of documents indexed")
+    duplicates_skipped: int = Field(default=0, description="Number of near-duplicate pages skipped")
+    status: str = Field(default="complete",
+                        description="'complete'; 'limited' if max_pages was reached with pages still pending;"
+                                    " or 'interrupted' if the crawl stopped early. Limited and interrupted crawls can be resumed")
+    pages_pending: int = Field(default=0, description="Discovered pages not yet crawled")
+    pages_failed: int = Field(default=0, description="Pages that could not be fetched")
     
     class Config:
         schema_extra = {
             "example": {
-                "message": "Successfully crawled and indexed 12 documents from https://example.com",
-                "documents_indexed": 12
+                "message": "Successfully crawled and indexed 12 documents from https://example.com (3 near-duplicates skipped)",
+                "documents_indexed": 12,
+                "duplicates_skipped": 3,
+                "status": "complete",
+                "pages_pending": 0,
+                "pages_failed": 0
             }
         }
 
 class PdfUploadResponse(BaseModel):
     message: str = Field(..., description="Status message about the PDF processing")
     documents_indexed: int = Field(..., description="Number of pages indexed from the PDF")
+    duplicates_skipped: int = Field(default=0, description="Number of near-duplicate pages skipped")
     
     class Config:
         schema_extra = {
             "example": {
-                "message": "Successfully processed and indexed 5 pages from PDF: product_manual.pdf",
-                "documents_indexed": 5
+                "message": "Successfully processed and indexed 5 pages from PDF: product_manual.pdf (1 near-duplicates skipped)",
+                "documents_indexed": 5,
+                "duplicates_skipped": 1
             }
         }
 
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from langchain.schema import Document
+from config import settings
+from utils.langchain_utils import get_retriever
+from utils.rate_limiter import Priority, embedding_limiter, call_with_retry
+
+# Setup logging
+logging.basicConfig(filename=settings.log_path, level=logging.INFO)
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _tokens(query: str) -> frozenset:
+    return frozenset(_WORD_RE.findall(query.lower()))
+
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 1.0 if a == b else 0.0
+    return len(a & b) / len(a | b)
+
+
+class PrefetchEntry:
+    def __init__(self, query: str):
+        self.query = query
+        self.tokens = _tokens(query)
+        self.task: Optional[asyncio.Task] = None
+        self.created_at = time.monotonic()
+        # True while the embedding + Chroma call runs in a worker thread
+        self.in_call = False
+        self.discarded = False
+
+    def expired(self) -> bool:
+        return time.monotonic() - self.created_at > settings.prefetch_ttl
+
+
+class PrefetchCache:
+    """
+    Short-lived, per-session cache of speculative retrievals for type-ahead clients.
+
+    Each session keeps only its latest prefetch; a newer one discards the previous
+    one. `take` only waits for a prefetch whose provider call is running or done.
+    A discarded prefetch that is still waiting for admission is cancelled; one
+    whose provider call is already running in a thread is left to finish (cancelling
+    would not stop the thread) and counts against prefetch_max_concurrency until it
+    does. Prefetches run at the lowest embedding priority and are skipped outright
+    while real work is queued.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, PrefetchEntry]" = OrderedDict()
+        self._running = 0
+        self._stats: Dict[str, int] = {"scheduled": 0, "skipped": 0, "hits": 0, "misses": 0}
+
+    def _prune(self) -> None:
+        for session_id in [sid for sid, entry in self._entries.items() if entry.expired()]:
+            self._drop(session_id)
+        while len(self._entries) > settings.prefetch_max_sessions:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._discard(entry)
+
+    def _discard(self, entry: PrefetchEntry) -> None:
+        """Throw a prefetch away, cancelling it only if no provider call is in progress."""
+        entry.discarded = True
+        if not entry.in_call and not entry.task.done():
+            entry.task.cancel()
+
+    async def _retrieve(self, entry: PrefetchEntry) -> List[Document]:
+        retriever = get_retriever()
+
+        async def attempt() -> List[Document]:
+            # Runs inside admission; don't start (or retry) a call nobody wants any more
+            if entry.discarded:
+                raise asyncio.CancelledError()
+            entry.in_call = True
+            try:
+                return await asyncio.to_thread(retriever.get_relevant_documents, entry.query)
+            finally:
+                entry.in_call = False
+
+        return await call_with_retry(embedding_limiter, attempt, Priority.PREFETCH)
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._running -= 1
+        # Failures only mean a cache miss later; mark the exception as retrieved
+        if not task.cancelled():
+            task.exception()
+
+    def schedule(self, session_id: str, query: str) -> str:
+        """Start a speculative retrieval for `query`; returns "scheduled", "cached" or "skipped"."""
+        self._prune()
+        entry = self._entries.get(session_id)
+        if entry is not None and entry.query.strip().lower() == query.strip().lower():
+            return "cached"
+        if (len(query.strip()) < settings.prefetch_min_chars
+                or self._running >= settings.prefetch_max_concurrency
+                or embedding_limiter.queue_depth() > 0):
+            self._stats["skipped"] += 1
+            return "skipped"
+
+        self._drop(session_id)
+        entry = PrefetchEntry(query)
+        entry.task = asyncio.get_running_loop().create_task(self._retrieve(entry))
+        # Lowered by _finished only once the task, including any thread call, has ended
+        self._running += 1
+        entry.task.add_done_callback(self._finished)
+        self._entries[session_id] = entry
+        self._stats["scheduled"] += 1
+        return "scheduled"
+
+    async def take(self, session_id: Optional[str], query: str) -> Optional[List[Document]]:
+        """Return prefetched documents for a close-enough query in this session, or None."""
+        if not session_id:
+            return None
+        self._prune()
+        entry = self._entries.pop(session_id, None)
+        if entry is None or _similarity(entry.tokens, _tokens(query)) < settings.prefetch_match_threshold:
+            if entry is not None:
+                self._discard(entry)
+            self._stats["misses"] += 1
+            return None
+        if entry.task.cancelled():
+            self._stats["misses"] += 1
+            return None
+        if not entry.in_call and not entry.task.done():
+            # Still queued for admission; interactive retrieval will be admitted ahead of it
+            self._discard(entry)
+            self._stats["misses"] += 1
+            return None
+        try:
+            docs = await asyncio.wait_for(asyncio.shield(entry.task), timeout=settings.prefetch_join_timeout)
+        except asyncio.TimeoutError:
+            # Fall back to normal retrieval; a running prefetch finishes and is dropped
+            self._discard(entry)
+            self._stats["misses"] += 1
+            return None
+        except Exception as e:
+            logging.warning(f"Prefetch for session {session_id} failed: {str(e)}")
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        return docs
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self._entries), "running": self._running, **self._stats}
+
+
+prefetch_cache = PrefetchCache()
@@ -0,0 +1,402 @@
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from uuid import UUID, uuid4
+from langchain_core.callbacks import BaseCallbackHandler
+from config import settings
+
+# Setup logging
+logging.basicConfig(filename=settings.log_path, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+# Per-request stage timings; None whenever the current request is not being profiled
+_current_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "profile_timings", default=None
+)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Add `seconds` to stage `name` of the request being profiled, if any."""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings[name] = round(timings.get(name, 0.0) + seconds, 6)
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Time the enclosed block as stage `name` of the request being profiled, if any."""
+    if _current_timings.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+class StageTimingCallback(BaseCallbackHandler):
+    """LangChain callback that records retriever and LLM time as profiling stages."""
+
+    def __init__(self):
+        self._started: Dict[UUID, float] = {}
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, **kwargs) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs) -> None:
+        if run_id in self._started:
+            record_stage("retrieval", time.perf_counter() - self._started.pop(run_id))
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        if run_id in self._started:
+            record_stage("llm", time.perf_counter() - self._started.pop(run_id))
+
+
+def stage_callbacks() -> List[BaseCallbackHandler]:
+    """Callbacks to pass to a chain call; empty unless the current request is profiled."""
+    return [StageTimingCallback()] if _current_timings.get() is not None else []
+
+
+class SamplingProfiler:
+    """Background thread that samples the Python stacks of every other thread at a fixed interval."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or names.get(thread_id) == "loop-stall-detector":
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples[(names.get(thread_id, str(thread_id)), tuple(reversed(stack)))] += 1
+
+    def collapsed(self) -> str:
+        """Samples in Brendan Gregg's collapsed-stack format (input for flamegraph.pl)."""
+        lines = []
+        for (thread_name, stack), count in self.samples.most_common():
+            frames = [thread_name] + [f"{name} ({os.path.basename(file)}:{line})" for name, file, line in stack]
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str) -> Dict[str, Any]:
+        """Samples as a speedscope sampled profile, one profile per thread."""
+        frame_index: Dict[tuple, int] = {}
+        frames: List[Dict[str, Any]] = []
+        profiles: Dict[str, Dict[str, Any]] = {}
+        for (thread_name, stack), count in self.samples.items():
+            indices = []
+            for entry in stack:
+                if entry not in frame_index:
+                    frame_index[entry] = len(frames)
+                    frames.append({"name": entry[0], "file": entry[1], "line": entry[2]})
+                indices.append(frame_index[entry])
+            profile = profiles.setdefault(thread_name, {
+                "type": "sampled", "name": thread_name, "unit": "seconds",
+                "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+            })
+            profile["samples"].append(indices)
+            profile["weights"].append(count * self.interval)
+            profile["endValue"] += count * self.interval
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "zendalona-profiler",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+
+class ProfileSession:
+    """
+    One armed profiling run: the next `requests` requests, or everything within `seconds`.
+    Either way the session ends after at most settings.profile_max_seconds.
+    """
+
+    def __init__(self, requests: Optional[int], seconds: Optional[float]):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid4().hex[:6]}"
+        self.remaining = requests
+        now = time.monotonic()
+        self.deadline = now + seconds if seconds else None
+        self.max_seconds = max(seconds or 0, settings.profile_max_seconds)
+        self.hard_deadline = now + self.max_seconds
+        self.stopped = False
+        self.active = 0
+        self.requests: List[Dict[str, Any]] = []
+        self.sampler = SamplingProfiler(settings.profile_sample_interval)
+        self.sampler.start()
+
+    def accepting(self) -> bool:
+        if self.stopped or time.monotonic() >= self.hard_deadline:
+            return False
+        if self.deadline is not None:
+            return time.monotonic() < self.deadline
+        return self.remaining is not None and self.remaining > 0
+
+    def finished(self) -> bool:
+        # At the hard deadline the session is written even with requests still in flight
+        if time.monotonic() >= self.hard_deadline:
+            return True
+        return self.active == 0 and not self.accepting()
+
+
+class Profiler:
+    """Arms profiling sessions and writes their results to settings.profile_output_dir."""
+
+    def __init__(self):
+        self.session: Optional[ProfileSession] = None
+        self.last_output: Optional[Dict[str, str]] = None
+        self._finalizing: Optional[asyncio.Task] = None
+
+    def _start(self, requests: Optional[int], seconds: Optional[float]) -> ProfileSession:
+        self.session = ProfileSession(requests, seconds)
+        loop = asyncio.get_running_loop()
+        if seconds:
+            loop.call_later(seconds, self._maybe_finish)
+        loop.call_later(self.session.max_seconds, self._maybe_finish)
+        return self.session
+
+    def arm(self, requests: Optional[int] = None, seconds: Optional[float] = None) -> ProfileSession:
+        if self.session is not None:
+            raise RuntimeError("A profiling session is already running")
+        logger.info(f"Profiling armed: requests={requests} seconds={seconds}")
+        return self._start(requests, seconds)
+
+    def stop(self) -> bool:
+        """Stop accepting requests; the session is written once in-flight ones finish."""
+        if self.session is None:
+            return False
+        self.session.stopped = True
+        self._maybe_finish()
+        return True
+
+    def wants(self, scope) -> bool:
+        if self.session is not None and self.session.accepting():
+            return True
+        if not settings.admin_token:
+            return False
+        token = settings.admin_token.encode("utf-8")
+        return any(
+            key == PROFILE_HEADER and hmac.compare_digest(value, token) for key, value in scope.get("headers", [])
+        )
+
+    def _begin(self) -> ProfileSession:
+        if self.session is None:
+            # Header-triggered: profile just this request
+            self._start(requests=1, seconds=None)
+        session = self.session
+        if session.remaining is not None:
+            session.remaining -= 1
+        session.active += 1
+        return session
+
+    def _end(self, session: ProfileSession, entry: Dict[str, Any]) -> None:
+        session.active -= 1
+        if session is not self.session:
+            logger.warning(
+                f"Dropping timings of {entry['method']} {entry['path']}: profiling session {session.id} "
+                f"was already written"
+            )
+            return
+        session.requests.append(entry)
+        self._maybe_finish()
+
+    def _maybe_finish(self) -> None:
+        session = self.session
+        if session is None or not session.finished():
+            return
+        self.session = None
+        if session.active:
+            logger.warning(
+                f"Profiling session {session.id} hit its {session.max_seconds:g}s limit; "
+                f"{session.active} in-flight requests are left out of its timings"
+            )
+        # Joining the sampler and serializing the output would block the event loop
+        self._finalizing = asyncio.get_running_loop().create_task(
+            asyncio.to_thread(self._finalize, session, list(session.requests), session.active)
+        )
+
+    def _finalize(self, session: ProfileSession, requests: List[Dict[str, Any]], left_out: int) -> None:
+        session.sampler.stop()
+        try:
+            self.last_output = self._write(session, requests, left_out)
+            logger.info(f"Profiling session {session.id} written to {self.last_output['speedscope']}")
+        except Exception as e:
+            logger.error(f"Error writing profiling session {session.id}: {str(e)}")
+
+    def _write(self, session: ProfileSession, requests: List[Dict[str, Any]], left_out: int) -> Dict[str, str]:
+        os.makedirs(settings.profile_output_dir, exist_ok=True)
+        base = os.path.join(settings.profile_output_dir, f"profile-{session.id}")
+        paths = {
+            "speedscope": f"{base}.speedscope.json",
+            "flamegraph": f"{base}.collapsed.txt",
+            "timings": f"{base}.timings.json",
+        }
+        with open(paths["speedscope"], "w") as f:
+            json.dump(session.sampler.speedscope(f"profile-{session.id}"), f)
+        with open(paths["flamegraph"], "w") as f:
+            f.write(session.sampler.collapsed())
+        with open(paths["timings"], "w") as f:
+            json.dump({
+                "duration_seconds": round(session.sampler.duration, 6),
+                "sample_interval_seconds": session.sampler.interval,
+                "requests": requests,
+                "in_flight_left_out": left_out,
+            }, f, indent=2)
+        return paths
+
+    def status(self) -> Dict[str, Any]:
+        session = self.session
+        return {
+            "active": session is not None,
+            "remaining_requests": session.remaining if session else None,
+            "in_flight": session.active if session else 0,
+            "last_output": self.last_output,
+        }
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles requests while a session is armed or when the
+    X-Profile header carries the admin token. Unprofiled requests pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.wants(scope) or scope["path"].startswith("/system/profile"):
+            await self.app(scope, receive, send)
+            return
+
+        session = profiler._begin()
+        timings: Dict[str, float] = {}
+        token = _current_timings.set(timings)
+        started = time.perf_counter()
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                record_stage("time_to_headers", time.perf_counter() - started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timings.reset(token)
+            profiler._end(session, {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "total_seconds": round(time.perf_counter() - started, 6),
+                "stages": timings,
+            })
+
+
+class LoopStallDetector:
+    """
+    Watchdog thread that logs the event loop thread's stack whenever the loop has not
+    run a heartbeat for longer than `threshold` seconds.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-stall-detector", daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop stall detector started (threshold {self.threshold * 1000:.0f} ms)")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _beat(self) -> None:
+        interval = self.threshold / 4
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(interval)
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.threshold / 4):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat
+            if stalled < self.threshold or reported == heartbeat:
+                continue
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+            logger.warning(f"Event loop blocked for {stalled * 1000:.0f} ms; loop thread stack:\n{stack}")
+
+
+stall_detector: Optional[LoopStallDetector] = None
+
+
+def start_stall_detector(threshold_ms: float) -> None:
+    global stall_detector
+    stop_stall_detector()
+    stall_detector = LoopStallDetector(threshold_ms / 1000)
+    stall_detector.start()
+
+
+def stop_stall_detector() -> None:
+    global stall_detector
+    if stall_detector is not None:
+        stall_detector.stop()
+        stall_detector = None
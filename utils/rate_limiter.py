@@ -0,0 +1,325 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from config import settings
+from utils.profiling import record_stage
+
+# Setup logging
+logging.basicConfig(filename=settings.log_path, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Admission priority; lower values are served first."""
+    INTERACTIVE = 0
+    INGESTION = 1
+    PREFETCH = 2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed because the wait queue is full or the wait timed out."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`, holding at most `burst` tokens."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until_available(self) -> float:
+        """Seconds until one token can be taken (0 if available now)."""
+        self._refill()
+        pause = max(0.0, self.paused_until - time.monotonic())
+        if self.tokens >= 1:
+            return pause
+        return max(pause, (1 - self.tokens) / self.rate)
+
+    def take(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds` and drop the current balance (used after a 429)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class AdmissionController:
+    """
+    Admission control in front of a Gemini API.
+
+    Callers wait in a bounded priority queue; a dispatcher admits them one at a time
+    when both a rate token and a concurrency slot are available. When the queue is
+    full a caller evicts the newest lower-priority waiter, otherwise the
+    caller is rejected immediately with AdmissionRejected.
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, burst: int,
+                 max_concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._queue: List[tuple] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats: Dict[str, Any] = {
+            "admitted": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "rate_limited": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    def _ensure_dispatcher(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _pending(self) -> List[tuple]:
+        return [entry for entry in self._queue if not entry[2].done()]
+
+    def queue_depth(self) -> int:
+        return len(self._pending())
+
+    def is_saturated(self, priority: Priority = Priority.INTERACTIVE) -> bool:
+        """True if a new caller with `priority` would be shed right now."""
+        pending = self._pending()
+        if len(pending) < self.max_queue:
+            return False
+        return not any(entry[0] > priority for entry in pending)
+
+    def _make_room(self, priority: Priority) -> None:
+        self._queue = self._pending()
+        heapq.heapify(self._queue)
+        if len(self._queue) < self.max_queue:
+            return
+        lower = [entry for entry in self._queue if entry[0] > priority]
+        if not lower:
+            self._stats["rejected"] += 1
+            raise AdmissionRejected(f"{self.name} queue is full", retry_after=self._retry_after())
+        victim = max(lower, key=lambda entry: (entry[0], entry[1]))
+        victim[2].set_exception(AdmissionRejected(
+            f"{self.name} queue is full; evicted for higher-priority work",
+            retry_after=self._retry_after(),
+        ))
+        self._stats["rejected"] += 1
+
+    def _retry_after(self) -> int:
+        backlog = len(self._queue) / max(self.bucket.rate, 1e-6)
+        return max(1, int(backlog))
+
+    async def _dispatch(self) -> None:
+        while True:
+            while self._queue and self._queue[0][2].done():
+                heapq.heappop(self._queue)
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self.in_flight >= self.max_concurrency:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self.bucket.time_until_available()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.bucket.take()
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @asynccontextmanager
+    async def admit(self, priority: Priority = Priority.INTERACTIVE):
+        """Wait for admission, hold a concurrency slot for the duration of the block."""
+        self._ensure_dispatcher()
+        self._make_room(priority)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._wakeup.set()
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+            else:
+                # Admitted in the same tick the timeout fired; give the slot back.
+                self._release()
+            self._stats["timed_out"] += 1
+            raise AdmissionRejected(
+                f"Timed out after {self.max_wait:.0f}s waiting for {self.name} capacity",
+                retry_after=self._retry_after(),
+            )
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            elif not future.cancelled() and future.exception() is None:
+                self._release()
+            raise
+
+        waited = time.monotonic() - started
+        self._stats["admitted"] += 1
+        self._stats["total_wait"] += waited
+        self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+        record_stage(f"{self.name}_admission_wait", waited)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def backoff(self, seconds: float) -> None:
+        """Hold back all callers for `seconds` after the provider returned a rate-limit error."""
+        self._stats["rate_limited"] += 1
+        self.bucket.pause(seconds)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        pending = self._pending()
+        admitted = self._stats["admitted"]
+        return {
+            "queue_depth": len(pending),
+            "queue_depth_by_priority": {
+                p.name.lower(): sum(1 for entry in pending if entry[0] == p) for p in Priority
+            },
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "rate_per_minute": self.bucket.rate * 60,
+            "admitted": admitted,
+            "rejected": self._stats["rejected"],
+            "timed_out": self._stats["timed_out"],
+            "rate_limited": self._stats["rate_limited"],
+            "avg_wait_seconds": round(self._stats["total_wait"] / admitted, 4) if admitted else 0.0,
+            "max_wait_seconds": round(self._stats["max_wait"], 4),
+        }
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Best-effort check for a Gemini quota / 429 error, whichever client raised it."""
+    if type(exc).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if code == 429:
+        return True
+    message = str(exc)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "quota" in message.lower()
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    ceiling = min(settings.gemini_backoff_max, settings.gemini_backoff_base * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+async def _retry_wait(limiter: AdmissionController, attempt: int, error: Exception) -> None:
+    """Re-raise `error` unless it is a retryable 429, otherwise back off before the next attempt."""
+    if not is_rate_limit_error(error) or attempt >= settings.gemini_max_retries:
+        raise error
+    delay = backoff_delay(attempt)
+    limiter.backoff(delay)
+    logger.warning(f"{limiter.name} rate limited (attempt {attempt + 1}), retrying in {delay:.2f}s")
+    await asyncio.sleep(delay)
+
+
+async def call_with_retry(limiter: AdmissionController, func: Callable[[], Awaitable[Any]],
+                          priority: Priority = Priority.INTERACTIVE) -> Any:
+    """
+    Admit and await `func()`, retrying with jittered backoff while Gemini answers with 429.
+
+    Every attempt goes through admission again, so retries take a fresh token from the
+    bucket (which a 429 has just paused) instead of adding calls on top of the quota.
+    """
+    attempt = 0
+    while True:
+        try:
+            async with limiter.admit(priority):
+                return await func()
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            await _retry_wait(limiter, attempt, e)
+            attempt += 1
+
+
+async def stream_with_retry(limiter: AdmissionController, make_stream: Callable[[], AsyncIterator[Any]],
+                            priority: Priority = Priority.INTERACTIVE) -> AsyncIterator[Any]:
+    """
+    Streaming counterpart of call_with_retry. The admission is held while chunks are
+    consumed; a 429 is only retried if no chunk has been yielded yet.
+    """
+    attempt = 0
+    while True:
+        started = False
+        try:
+            async with limiter.admit(priority):
+                async for chunk in make_stream():
+                    started = True
+                    yield chunk
+            return
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            if started:
+                raise
+            await _retry_wait(limiter, attempt, e)
+            attempt += 1
+
+
+llm_limiter = AdmissionController(
+    name="gemini-llm",
+    rate_per_minute=settings.gemini_llm_rpm,
+    burst=settings.gemini_llm_burst,
+    max_concurrency=settings.gemini_max_concurrency,
+    max_queue=settings.admission_queue_size,
+    max_wait=settings.admission_max_wait,
+)
+
+embedding_limiter = AdmissionController(
+    name="gemini-embedding",
+    rate_per_minute=settings.gemini_embedding_rpm,
+    burst=settings.gemini_embedding_burst,
+    max_concurrency=settings.gemini_max_concurrency,
+    max_queue=settings.admission_queue_size,
+    max_wait=settings.admission_max_wait,
+)